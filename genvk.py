@@ -3,14 +3,20 @@
 # Created by Gustavo C. Viegas.
 # Last change: 2024/aug.
 
-from copy import deepcopy
+from collections import defaultdict, namedtuple
+import hashlib
 import os
-import re
 import shutil
 import subprocess
 import sys
-from tempfile import TemporaryDirectory
-import xml.etree.ElementTree
+from tempfile import TemporaryDirectory, mkdtemp
+
+try:
+    from lxml import etree as ET
+    LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    LXML = False
 
 
 class Command:
@@ -23,6 +29,12 @@ class Command:
     INSTANCE = 1
     DEVICE = 2
 
+    __slots__ = ("proto", "params", "isext", "ext", "level")
+
+    # Types of the first param that identify the level.
+    INSTANCE_TYPES = frozenset(["VkInstance", "VkPhysicalDevice"])
+    DEVICE_TYPES = frozenset(["VkDevice", "VkQueue", "VkCommandBuffer"])
+
     def __init__(self, proto, params):
         self.proto = Command.Proto(proto)
         self.params = []
@@ -35,9 +47,9 @@ class Command:
         if len(self.params) == 0:
             return
         s = self.params[0].typ
-        if s == "VkInstance" or s == "VkPhysicalDevice":
+        if s in Command.INSTANCE_TYPES:
             self.level = Command.INSTANCE
-        elif s == "VkDevice" or s == "VkQueue" or s == "VkCommandBuffer":
+        elif s in Command.DEVICE_TYPES:
             if self.proto.name != "vkGetDeviceProcAddr":
                 self.level = Command.DEVICE
             else:
@@ -45,42 +57,55 @@ class Command:
                 # using a valid VkInstance handle.
                 self.level = Command.INSTANCE
 
+    def renamed(self, name):
+        """Returns a shallow copy of the Command with a different name.
+
+        The params and ext are shared with the original."""
+        cpy = object.__new__(Command)
+        cpy.proto = object.__new__(Command.Proto)
+        cpy.proto.name = name
+        cpy.proto.typ = self.proto.typ
+        cpy.params = self.params
+        cpy.isext = self.isext
+        if self.isext:
+            cpy.ext = self.ext
+        cpy.level = self.level
+        return cpy
+
     def __str__(self):
-        s = str(self.proto) + "(\n    "
-        n = len(self.params)
-        if n > 0:
-            for i in range(n-1):
-               s += str(self.params[i]) + ",\n    "
-            s += str(self.params[n-1])
-        s += ")"
-        return s
+        return str(self.proto) + "(\n    " + ",\n    ".join(str(x) for x in self.params) + ")"
 
     class TypeName:
         """registry > commands > command > *elem* > type,name."""
+        __slots__ = ("name", "typ")
+
         def __init__(self, elem):
-            name = elem.find("name")
+            name = None
+            typ = None
+            for child in elem:
+                tag = child.tag
+                if tag == "name":
+                    if name is None:
+                        name = child
+                elif tag == "type":
+                    if typ is None:
+                        typ = child
             assert(name is not None and name.text is not None)
-            self.name = name.text.strip()
-            typ = elem.find("type")
+            self.name = sys.intern(name.text.strip())
             assert(typ is not None and typ.text is not None)
-            self.typ = ""
-            if elem.text is not None:
-                self.typ = elem.text
-            self.typ += typ.text
-            if typ.tail is not None:
-                self.typ += typ.tail
-            self.typ = self.typ.strip()
+            # Types repeat across many params, so share their storage.
+            self.typ = sys.intern("".join((elem.text or "", typ.text, typ.tail or "")).strip())
 
         def __str__(self):
             return self.typ + " " + self.name
 
     class Proto(TypeName):
         """registry > commands > command > proto."""
-        pass
+        __slots__ = ()
 
     class Param(TypeName):
         """registry > commands > command > param."""
-        pass
+        __slots__ = ()
 
 
 class Extension:
@@ -101,32 +126,14 @@ class Extension:
         XCB: ("#ifdef VK_USE_PLATFORM_XCB_KHR\n", "#endif\n")
         }
 
+    __slots__ = ("category",)
+
     def __init__(self, command):
         self.category = Extension.NA
-        if not command.isext:
-            return
-        for e in Extension.NAMES_COMMON:
-            if e == command.proto.name:
-                self.category = Extension.COMMON
-                return
-        for e in Extension.NAMES_ANDROID:
-            if e == command.proto.name:
-                self.category = Extension.ANDROID
-                return
-        for e in Extension.NAMES_WAYLAND:
-            if e == command.proto.name:
-                self.category = Extension.WAYLAND
-                return
-        for e in Extension.NAMES_WIN32:
-            if e == command.proto.name:
-                self.category = Extension.WIN32
-                return
-        for e in Extension.NAMES_XCB:
-            if e == command.proto.name:
-                self.category = Extension.XCB
-                return
-
-    NAMES_COMMON = [
+        if command.isext:
+            self.category = Extension.CATEGORIES.get(command.proto.name, Extension.NA)
+
+    NAMES_COMMON = frozenset([
         # From VK_KHR_surface:
         "vkDestroySurfaceKHR",
         "vkGetPhysicalDeviceSurfaceCapabilitiesKHR",
@@ -183,40 +190,54 @@ class Extension:
         "vkGetPhysicalDeviceProperties2KHR",
         "vkGetPhysicalDeviceQueueFamilyProperties2KHR",
         "vkGetPhysicalDeviceSparseImageFormatProperties2KHR",
-        ]
+        ])
 
-    NAMES_ANDROID = [
+    NAMES_ANDROID = frozenset([
         # From VK_KHR_android_surface:
         "vkCreateAndroidSurfaceKHR",
-        ]
+        ])
 
-    NAMES_WAYLAND = [
+    NAMES_WAYLAND = frozenset([
         # From VK_KHR_wayland_surface:
         "vkCreateWaylandSurfaceKHR",
         "vkGetPhysicalDeviceWaylandPresentationSupportKHR",
-        ]
+        ])
 
-    NAMES_WIN32 = [
+    NAMES_WIN32 = frozenset([
         # From VK_KHR_win32_surface:
         "vkCreateWin32SurfaceKHR",
         "vkGetPhysicalDeviceWin32PresentationSupportKHR",
-        ]
+        ])
 
-    NAMES_XCB = [
+    NAMES_XCB = frozenset([
         # From VK_KHR_xcb_surface:
         "vkCreateXcbSurfaceKHR",
         "vkGetPhysicalDeviceXcbPresentationSupportKHR",
-        ]
+        ])
+
+    # Maps each known extension name to its category.
+    CATEGORIES = {
+        name: categ
+        for (categ, names) in (
+            (COMMON, NAMES_COMMON),
+            (ANDROID, NAMES_ANDROID),
+            (WAYLAND, NAMES_WAYLAND),
+            (WIN32, NAMES_WIN32),
+            (XCB, NAMES_XCB))
+        for name in names
+        }
 
 
 # TODO: Currently, this is only used for filtering non-core commands.
 class Feature:
     """registry > feature."""
+    __slots__ = ("name", "cmds", "noncore")
+
     def __init__(self, feature):
         assert(feature.tag == "feature")
         self.name = feature.attrib["name"]
         self.cmds = [x.get("name") for x in feature.findall("./require/command")]
-        self.noncore = re.match(r"(^|(.+,))vulkan((,.+)|$)", feature.get("api")) is None
+        self.noncore = "vulkan" not in (feature.get("api") or "").split(",")
 
 
 class Version:
@@ -246,7 +267,7 @@ class Version:
 
 
 HEADER = """// Code generated by genvk.py. DO NOT EDIT.
-// [vk.xml {}]
+// [vk.xml %s]
 
 #ifndef GENVK_VK_H
 #define GENVK_VK_H
@@ -263,22 +284,22 @@ HEADER = """// Code generated by genvk.py. DO NOT EDIT.
 #include <vulkan/vulkan.h>
 
 #ifdef __cplusplus
-extern "C" {{
+extern "C" {
 #endif
 
 // Function pointers.
-{}
+%s
 // Functions that obtain the function pointers.
 // The usage is as follows:
 //  1. Call getGlobalProcsVK and check that vkGetInstanceProcAddr is valid;
 //  2. Create a valid VkInstance and call getInstanceProcsVK;
 //  3. Create a valid VkDevice and call getDeviceProcsVK;
 //  4. Call clearProcsVK before exiting.
-{}
-{}
+%s
+%s
 
 #ifdef __cplusplus
-}}
+}
 #endif
 
 #endif // GENVK_VK_H
@@ -286,17 +307,17 @@ extern "C" {{
 
 
 SOURCE = """// Code generated by genvk.py. DO NOT EDIT.
-// [vk.xml {}]
+// [vk.xml %s]
 
 #include "vk.h"
 
-{}
+%s
 // Defined in dlvk.cpp.
 void* initVK();
 void deinitVK();
 
-{}
-{}
+%s
+%s
 """
 
 
@@ -321,176 +342,216 @@ VK_H = "vk.h"
 VK_LIB = "vk.lib"
 
 
-def gen_getters(commands, as_decls):
-    """Returns a string containing the proc getters."""
-    if as_decls:
-        globl = "void getGlobalProcsVK(void);\n"
-        inst = "void getInstanceProcsVK(VkInstance);\n"
-        dev = "void getDeviceProcsVK(VkDevice);"
-        return globl + inst + dev
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "genvk")
 
-    fp = INDENT + "PFN_vkVoidFunction fp = nullptr;\n"
-    globl = "void getGlobalProcsVK()\n{\n" + INDENT + INIT_CALL + fp
-    inst = "void getInstanceProcsVK(VkInstance h)\n{\n" + fp
-    dev = "void getDeviceProcsVK(VkDevice h)\n{\n" + fp
-    gext = {}
-    iext = {}
-    dext = {}
-    gfmt = INDENT + 'fp = vkGetInstanceProcAddr(nullptr, "{}");\n'
-    gfmt += INDENT + "{} = reinterpret_cast<PFN_{}>(fp);\n"
-    ifmt = INDENT + 'fp = vkGetInstanceProcAddr(h, "{}");\n'
-    ifmt += INDENT + "{} = reinterpret_cast<PFN_{}>(fp);\n"
-    dfmt = INDENT + 'fp = vkGetDeviceProcAddr(h, "{}");\n'
-    dfmt += INDENT + "{} = reinterpret_cast<PFN_{}>(fp);\n"
-
-    for cmd in commands:
-        name = cmd.proto.name
-        if not name.startswith("vk"):
-            continue
-        if name == "vkGetInstanceProcAddr":
-            # vkGetInstanceProcAddr is obtained by other means.
-            continue
-        if not cmd.isext:
-            if cmd.level == Command.DEVICE:
-                dev += dfmt.format(name, name, name)
-            elif cmd.level == Command.INSTANCE:
-                inst += ifmt.format(name, name, name)
-            else:
-                globl += gfmt.format(name, name, name)
+
+def get_proc(getter, handle, name):
+    """Returns the statements that obtain a proc through the given getter."""
+    return (f'{INDENT}fp = {getter}({handle}, "{name}");\n'
+            f"{INDENT}{name} = reinterpret_cast<PFN_{name}>(fp);\n")
+
+
+class Bucket:
+    """Names of procs, with extension procs grouped by category."""
+    def __init__(self):
+        self.core = []
+        self.exts = defaultdict(list)
+
+    def append(self, categ, name):
+        """Appends name to the core procs if categ is None, or to the
+        procs of extension category categ otherwise."""
+        if categ is None:
+            self.core.append(name)
         else:
-            categ = cmd.ext.category
-            if categ == Extension.NA:
-                continue
-            if cmd.level == Command.DEVICE:
-                if not categ in dext:
-                    dext[categ] = ""
-                dext[categ] += dfmt.format(name, name, name)
-            elif cmd.level == Command.INSTANCE:
-                if not categ in iext:
-                    iext[categ] = ""
-                iext[categ] += ifmt.format(name, name, name)
-            else:
-                if not categ in gext:
-                    gext[categ] = ""
-                gext[categ] += gfmt.format(name, name, name)
-
-    items = gext.items()
-    for (k, v) in items:
-        if v != "":
-            globl += cmd.ext.GUARDS[k][0] + v + cmd.ext.GUARDS[k][1]
-    items = iext.items()
-    for (k, v) in items:
-        if v != "":
-            inst += cmd.ext.GUARDS[k][0] + v + cmd.ext.GUARDS[k][1]
-    items = dext.items()
-    for (k, v) in items:
-        if v != "":
-            dev += cmd.ext.GUARDS[k][0] + v + cmd.ext.GUARDS[k][1]
-    globl += "}\n\n"
-    inst += "}\n\n"
-    dev += "}\n"
-    return globl + inst + dev
-
-
-def gen_procs(commands, proc_fmt):
-    """Returns a string containing the formatted procs."""
-    procs = ""
-    exts = {}
-    for cmd in commands:
-        name = cmd.proto.name
-        if not name.startswith("vk"):
-            continue
-        if not cmd.isext:
-            procs += proc_fmt.format(name)
-            continue
-        categ = cmd.ext.category
-        if categ == Extension.NA:
-            continue
-        if not categ in exts:
-            exts[categ] = ""
-        exts[categ] += proc_fmt.format(name)
-    items = exts.items()
-    for (k, v) in items:
-        if v != "":
-            procs += cmd.ext.GUARDS[k][0] + v + cmd.ext.GUARDS[k][1]
-    return procs
+            self.exts[categ].append(name)
 
+    def render(self, fmt):
+        """Returns the concatenation of fmt(name) for every name in the
+        bucket, with each extension category enclosed in its guards."""
+        parts = [fmt(x) for x in self.core]
+        for (k, v) in self.exts.items():
+            (begin, end) = Extension.GUARDS[k]
+            parts.append(begin)
+            parts += [fmt(x) for x in v]
+            parts.append(end)
+        return "".join(parts)
 
-def gen_vars(commands, as_decls):
-    """Returns a string containing the proc variables."""
-    return gen_procs(commands, "extern PFN_{0} {0};\n" if as_decls else "PFN_{0} {0} = nullptr;\n")
 
+Output = namedtuple("Output", [
+    "decl_vars", "def_vars",
+    "decl_getters", "def_getters",
+    "decl_clear", "def_clear"])
 
-def gen_clear(commands, as_decl):
-    """Returns a string containing the proc clearing function."""
-    if as_decl:
-        return "void clearProcsVK(void);"
-    procs = gen_procs(commands, INDENT + "{} = nullptr;\n")
-    return "void clearProcsVK()\n{\n" + procs + INDENT + DEINIT_CALL + "}"
 
+# Procs sorted by output section: procs holds every emitted proc,
+# while globl, inst and dev hold the ones obtained by each getter.
+Bucketed = namedtuple("Bucketed", ["procs", "globl", "inst", "dev"])
 
-def gen_commands(registry):
-    """Returns a list containing Commands from the registry."""
-    noncore_feats = [x for x in [Feature(x) for x in registry.findall("feature")] if x.noncore]
-    noncore_cmds = frozenset()
-    for feat in noncore_feats:
-        noncore_cmds = noncore_cmds.union(feat.cmds)
 
-    cmds = registry.find("commands")
-    if cmds is None:
-        print("[err] bad xml file: 'commands' element not found")
-        exit()
-    each_cmd = cmds.findall("command")
+def emit_all(buckets):
+    """Returns an Output containing the code generated from the given
+    Bucketed procs."""
+    (procs, globl, inst, dev) = buckets
+    fp = INDENT + "PFN_vkVoidFunction fp = nullptr;\n"
+    return Output(
+        decl_vars=procs.render(lambda x: f"extern PFN_{x} {x};\n"),
+        def_vars=procs.render(lambda x: f"PFN_{x} {x} = nullptr;\n"),
+        decl_getters=("void getGlobalProcsVK(void);\n"
+                      "void getInstanceProcsVK(VkInstance);\n"
+                      "void getDeviceProcsVK(VkDevice);"),
+        def_getters="".join([
+            "void getGlobalProcsVK()\n{\n", INDENT, INIT_CALL, fp,
+            globl.render(lambda x: get_proc("vkGetInstanceProcAddr", "nullptr", x)),
+            "}\n\n",
+            "void getInstanceProcsVK(VkInstance h)\n{\n", fp,
+            inst.render(lambda x: get_proc("vkGetInstanceProcAddr", "h", x)),
+            "}\n\n",
+            "void getDeviceProcsVK(VkDevice h)\n{\n", fp,
+            dev.render(lambda x: get_proc("vkGetDeviceProcAddr", "h", x)),
+            "}\n"]),
+        decl_clear="void clearProcsVK(void);",
+        def_clear="".join([
+            "void clearProcsVK()\n{\n",
+            procs.render(lambda x: f"{INDENT}{x} = nullptr;\n"),
+            INDENT, DEINIT_CALL, "}"]))
+
+
+# Size of the chunks fed to XMLPullParser.
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_xml(xml_path, events):
+    """Yields the (event, elem) pairs produced while parsing xml_path.
+
+    lxml's iterparse is used when available. Otherwise, the file is fed
+    to an XMLPullParser in chunks."""
+    if LXML:
+        yield from ET.iterparse(xml_path, events=events)
+        return
+    parser = ET.XMLPullParser(events=events)
+    with open(xml_path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
+
+
+def iter_registry(xml_path):
+    """Yields (tag, elem) for the commands, feature and types elements of
+    the registry and for each command in commands.
+
+    Elements are discarded as soon as the caller is done with them, so the
+    full document tree is never held in memory."""
+    stack = []
+    for (event, elem) in iter_xml(xml_path, ("start", "end")):
+        if event == "start":
+            if not stack and elem.tag != "registry":
+                print("[err] bad xml file: unexpected root element '" + elem.tag + "'")
+                exit()
+            stack.append(elem)
+            continue
+        stack.pop()
+        depth = len(stack)
+        tag = elem.tag
+        if depth == 2 and tag == "command" and stack[-1].tag == "commands":
+            # registry > commands > command.
+            yield (tag, elem)
+        elif depth == 1:
+            # registry > *.
+            if tag in ("commands", "feature", "types"):
+                yield (tag, elem)
+        else:
+            continue
+        elem.clear()
+        # Drop the siblings consumed so far.
+        del stack[-1][:-1]
+
+
+def parse_registry(xml_path):
+    """Parses the registry, returning its commands, aliases, features
+    and version.
 
+    The commands are None if the registry has no commands element."""
+    cmds = []
+    has_cmds = False
     aliases = {}
-    for cmd in each_cmd:
-        if cmd.get("api") not in (None, "vulkan"):
-            continue
-        alias = cmd.get("alias")
-        name = cmd.get("name")
-        if alias is not None and name is not None:
-            # TODO: Do multiple aliases exist?
-            aliases[alias] = name
-            # TODO: Remove element instead.
-            assert(cmd.find("proto") is None)
+    feats = []
+    version = None
+    for (tag, elem) in iter_registry(xml_path):
+        if tag == "command":
+            if elem.get("api") not in (None, "vulkan"):
+                continue
+            proto = elem.find("proto")
+            if proto is not None:
+                cmds.append(Command(proto, elem.findall("param")))
+                continue
+            alias = elem.get("alias")
+            name = elem.get("name")
+            if alias is not None and name is not None:
+                # TODO: Do multiple aliases exist?
+                aliases[alias] = name
+        elif tag == "commands":
+            has_cmds = True
+        elif tag == "feature":
+            feats.append(Feature(elem))
+        else:
+            version = Version(elem)
+    return (cmds if has_cmds else None, aliases, feats, version)
+
+
+def gen_commands(cmds, aliases, feats):
+    """Returns the core Commands and their aliases as Bucketed procs."""
+    noncore_cmds = frozenset(cmd for feat in feats if feat.noncore for cmd in feat.cmds)
 
     objs = []
-    for cmd in each_cmd:
-        if cmd.get("api") not in (None, "vulkan"):
-            continue
-        proto = cmd.find("proto")
-        if proto is None:
-            continue
-        params = cmd.findall("param")
-        obj = Command(proto, params)
+    for obj in cmds:
         if obj.proto.name in noncore_cmds:
             continue
         objs.append(obj)
         try:
             alias = aliases[obj.proto.name]
-            cpy = deepcopy(obj)
-            cpy.proto.name = alias
-            objs.append(cpy)
+            objs.append(obj.renamed(alias))
         except KeyError:
             pass
-    return objs
 
+    # Keep only the procs that are emitted.
+    objs = [x for x in objs
+            if x.proto.name.startswith("vk") and not (x.isext and x.ext.category == Extension.NA)]
 
-def gen_version(registry):
-    """Returns a Version instance identifying the header version."""
-    types = registry.find("types")
-    if types is None:
-        print("[err] bad xml file: 'types' element not found")
-        exit()
-    return Version(types)
+    buckets = Bucketed(Bucket(), Bucket(), Bucket(), Bucket())
+    for obj in objs:
+        name = obj.proto.name
+        categ = obj.ext.category if obj.isext else None
+        buckets.procs.append(categ, name)
+        if name == "vkGetInstanceProcAddr":
+            # vkGetInstanceProcAddr is obtained by other means.
+            continue
+        if obj.level == Command.DEVICE:
+            buckets.dev.append(categ, name)
+        elif obj.level == Command.INSTANCE:
+            buckets.inst.append(categ, name)
+        else:
+            buckets.globl.append(categ, name)
+    return buckets
 
 
 def gen_lib():
     if os.name == "posix":
         # Assume gcc/clang.
         cpl = ["c++", "-O2", "-c"]
-        subprocess.run(cpl + [DLVK_CPP], check=True)
-        subprocess.run(cpl + [VK_CPP], check=True)
+        # The sources are independent, so compile them concurrently.
+        procs = [subprocess.Popen(cpl + [p]) for p in [DLVK_CPP, VK_CPP]]
+        for p in procs:
+            p.wait()
+        for p in procs:
+            if p.returncode != 0:
+                raise subprocess.CalledProcessError(p.returncode, p.args)
         subprocess.run(["ar", "rcs", VK_LIB, DLVK_OBJ, VK_OBJ], check=True)
     else:
         # TODO
@@ -506,34 +567,76 @@ def fmt_vk_h():
         print("[warn] clang-format not found")
 
 
+def cache_key(xml_path):
+    """Returns a key identifying the outputs generated from xml_path.
+
+    The key also covers this script and dlvk.cpp, since changing either
+    changes the outputs."""
+    h = hashlib.blake2b()
+    for p in [xml_path, __file__, DLVK_CPP]:
+        with open(p, "rb") as f:
+            h.update(hashlib.blake2b(f.read()).digest())
+    return h.hexdigest()
+
+
+def load_cache(key):
+    """Copies the cached outputs for key into the current directory.
+    Returns whether they were found."""
+    cached = os.path.join(CACHE_DIR, key)
+    paths = [os.path.join(cached, p) for p in [VK_H, VK_LIB]]
+    if not all(os.path.isfile(p) for p in paths):
+        return False
+    for p in paths:
+        shutil.copy(p, os.path.basename(p))
+    return True
+
+
+def store_cache(key):
+    """Copies the outputs in the current directory into the cache."""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmpdir = mkdtemp(dir=CACHE_DIR)
+        for p in [VK_H, VK_LIB]:
+            shutil.copy(p, os.path.join(tmpdir, p))
+        # Another run may have stored the same key meanwhile.
+        try:
+            os.rename(tmpdir, os.path.join(CACHE_DIR, key))
+        except OSError:
+            shutil.rmtree(tmpdir)
+    except OSError as e:
+        print("[warn] could not cache outputs: {}".format(e))
+
+
 def gen(xml_path):
     """Generates the proc files from the given vk.xml registry."""
-    tree = xml.etree.ElementTree.parse(xml_path)
-    root = tree.getroot()
-    if root.tag != "registry":
-        print("[err] bad xml file: unexpected root element '" + root.tag + "'")
+    key = cache_key(xml_path)
+    if load_cache(key):
+        return
+    (cmds, aliases, feats, version) = parse_registry(xml_path)
+    if cmds is None:
+        print("[err] bad xml file: 'commands' element not found")
+        exit()
+    if version is None:
+        print("[err] bad xml file: 'types' element not found")
         exit()
-    commands = gen_commands(root)
-    version = gen_version(root)
+    buckets = gen_commands(cmds, aliases, feats)
     with TemporaryDirectory() as tmpdir:
         cwd = os.getcwd()
         os.chdir(tmpdir)
-        with open(VK_H, "w") as f:
-            vars = gen_vars(commands, True)
-            getters = gen_getters(commands, True)
-            clear = gen_clear(commands, True)
-            f.write(HEADER.format(version, vars, getters, clear))
-        with open(VK_CPP, "w") as f:
-            vars = gen_vars(commands, False)
-            getters = gen_getters(commands, False)
-            clear = gen_clear(commands, False)
-            f.write(SOURCE.format(version, vars, getters, clear))
+        out = emit_all(buckets)
+        header = HEADER % (version, out.decl_vars, out.decl_getters, out.decl_clear)
+        with open(VK_H, "wb") as f:
+            f.write(header.encode())
+        source = SOURCE % (version, out.def_vars, out.def_getters, out.def_clear)
+        with open(VK_CPP, "wb") as f:
+            f.write(source.encode())
         shutil.copy(os.path.join(cwd, DLVK_CPP), DLVK_CPP)
         gen_lib()
         os.chdir(cwd)
         shutil.copy(os.path.join(tmpdir, VK_H), VK_H)
         shutil.copy(os.path.join(tmpdir, VK_LIB), VK_LIB)
         fmt_vk_h()
+    store_cache(key)
 
 
 if __name__ == "__main__":